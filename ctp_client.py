@@ -5,40 +5,191 @@ CTP Protocol Client
 Used to send STA_SSID_INFO commands to devices
 """
 
+import functools
 import socket
 import struct
 import json
+import logging
+import select
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+log = logging.getLogger(__name__)
+
+# CTP frame: "CTP:" | topic length (2) | topic | content length (4) | content
+CTP_PREFIX = b"CTP:"
+CTP_PREFIX_LEN = 4
+CTP_TOPIC_LEN = 2
+CTP_TOPIC_CONTENT_LEN = 4
+CTP_HEADER_LEN = CTP_PREFIX_LEN + CTP_TOPIC_LEN   # prefix + topic length
+
+# Precompiled little-endian fields of the CTP header
+_PREFIX_AND_TLEN = struct.Struct('<4sH')   # "CTP:" + topic length (6 bytes)
+_HDR_I = struct.Struct('<I')               # content length (4 bytes)
+
+# Gather-write support (not available on Windows)
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+# Size of the speculative first read of a response; covers typical small frames
+_RECV_CHUNK = 8192
+
+# Pre-encoded constant topics
+_TOPIC_STA_SSID_INFO = b"STA_SSID_INFO"
+
+# Fixed-shape STA_SSID_INFO payloads; every field is filled in as a JSON-encoded value
+_STA_SSID_INFO_TMPL = '{{"op":"PUT","param":{{"ssid":{ssid},"pwd":{pwd},"status":{status}}}}}'
+_STA_SSID_INFO_MQTT_TMPL = (
+    '{{"op":"PUT","param":{{"ssid":{ssid},"pwd":{pwd},"status":{status},'
+    '"mqtt_server":{mqtt_server},"mqtt_port":{mqtt_port}}}}}'
+)
+
+
+def _sta_ssid_info_content(ssid, password, status="0", mqtt_server=None, mqtt_port=None):
+    """Build the compact UTF-8 JSON content of a STA_SSID_INFO command"""
+    if mqtt_server is None:
+        content_str = _STA_SSID_INFO_TMPL.format(
+            ssid=json.dumps(ssid), pwd=json.dumps(password), status=json.dumps(status))
+    else:
+        content_str = _STA_SSID_INFO_MQTT_TMPL.format(
+            ssid=json.dumps(ssid), pwd=json.dumps(password), status=json.dumps(status),
+            mqtt_server=json.dumps(mqtt_server), mqtt_port=json.dumps(str(mqtt_port)))
+    return content_str.encode('utf-8')
+
+
+def unpack_topic_len(buf, offset=0):
+    """
+    Check the CTP prefix at buf[offset:] and return the topic length after it
+    
+    Raises:
+        ValueError: If the prefix is not "CTP:"
+    """
+    prefix, topic_len = _PREFIX_AND_TLEN.unpack_from(buf, offset)
+    if prefix != CTP_PREFIX:
+        raise ValueError(f"Invalid CTP prefix: {prefix!r}")
+    return topic_len
+
+
+def unpack_content_len(buf, offset=0):
+    """Return the content length field at buf[offset:]"""
+    return _HDR_I.unpack_from(buf, offset)[0]
+
+
+def _pack_frame(topic_bytes, content_bytes):
+    """Build a complete CTP frame in a single allocation"""
+    return b''.join((
+        _PREFIX_AND_TLEN.pack(CTP_PREFIX, len(topic_bytes)),   # "CTP:" + topic length (6 bytes, little endian)
+        topic_bytes,                                        # topic content
+        _HDR_I.pack(len(content_bytes)),                    # content length (4 bytes, little endian)
+        content_bytes                                       # content data
+    ))
+
+
+@functools.lru_cache(maxsize=64)
+def build_sta_ssid_frame(ssid, password, status="0", mqtt_server=None, mqtt_port=None):
+    """
+    Build the complete CTP frame of a STA_SSID_INFO command
+    
+    Frames are cached, so replaying one configuration to many devices
+    serializes and packs it only once.
+    
+    Returns:
+        bytes: Ready-to-send frame
+    """
+    content_bytes = _sta_ssid_info_content(ssid, password, status, mqtt_server, mqtt_port)
+    return _pack_frame(_TOPIC_STA_SSID_INFO, content_bytes)
+
 class CTPClient:
-    def __init__(self, host='192.168.4.1', port=3333):
+    def __init__(self, host='192.168.4.1', port=3333, sndbuf=None, rcvbuf=None):
         """
         Initialize CTP Client
         
         Args:
             host: Device IP address
             port: Device port number
+            sndbuf: SO_SNDBUF size in bytes, None keeps kernel autotuning
+            rcvbuf: SO_RCVBUF size in bytes, None keeps kernel autotuning
+        
+        On Linux, setting either buffer size fixes it and disables autotuning
+        for that buffer, so only pass a size after measuring that it helps.
+        The sizes are applied once connected, i.e. after the TCP handshake.
         """
         self.host = host
         self.port = port
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
         self.sock = None
+        self._rxbuf = bytearray(_RECV_CHUNK)  # receive buffer, kept at capacity
+        self._rxlen = 0                       # bytes of _rxbuf not yet consumed
+        self._timeout = None       # timeout currently set on self.sock
         
         # CTP Protocol Constants
-        self.CTP_PREFIX = b"CTP:"
-        self.CTP_PREFIX_LEN = 4
-        self.CTP_TOPIC_LEN = 2
-        self.CTP_TOPIC_CONTENT_LEN = 4
+        self.CTP_PREFIX = CTP_PREFIX
+        self.CTP_PREFIX_LEN = CTP_PREFIX_LEN
+        self.CTP_TOPIC_LEN = CTP_TOPIC_LEN
+        self.CTP_TOPIC_CONTENT_LEN = CTP_TOPIC_CONTENT_LEN
         
     def connect(self):
         """Connect to device"""
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(10)  # 设置超时时间
-            self.sock.connect((self.host, self.port))
-            print(f"Successfully connected to {self.host}:{self.port}")
+            # Tries every address getaddrinfo returns (IPv4 and IPv6) with a 10 s timeout
+            self.sock = socket.create_connection((self.host, self.port), timeout=10)
+            self._timeout = 10
+            self._rxlen = 0
+            # Small request/response frames: disable Nagle
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self.sndbuf is not None:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+            if self.rcvbuf is not None:
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            log.debug("Successfully connected to %s:%s", self.host, self.port)
             return True
         except Exception as e:
-            print(f"Connection failed: {e}")
+            log.error("Connection to %s:%s failed: %s", self.host, self.port, e)
+            return False
+    
+    def __enter__(self):
+        if not self.connect():
+            raise ConnectionError(f"Could not connect to {self.host}:{self.port}")
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+    
+    def is_alive(self):
+        """
+        Check, without blocking, whether the connection is still usable
+        
+        Returns:
+            bool: False if not connected or the device has closed the connection
+        """
+        if not self.sock:
+            return False
+        try:
+            if hasattr(select, 'poll'):
+                # Unlike select(), poll() accepts descriptors >= FD_SETSIZE
+                poller = select.poll()
+                poller.register(self.sock, select.POLLIN)
+                readable = poller.poll(0)
+            else:  # Windows: select() has no descriptor-value limit there
+                readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return True
+            # Readable with nothing to peek at means the device sent FIN
+            return bool(self.sock.recv(1, socket.MSG_PEEK))
+        except OSError:
             return False
     
     def disconnect(self):
@@ -46,7 +197,9 @@ class CTPClient:
         if self.sock:
             self.sock.close()
             self.sock = None
-            print("Disconnected")
+            self._timeout = None
+            self._rxlen = 0
+            log.debug("Disconnected")
     
     def send_ctp_message(self, topic, content):
         """
@@ -54,72 +207,112 @@ class CTPClient:
         
         Args:
             topic: Topic name
-            content: Message content
+            content: Message content (str, or already encoded bytes)
+            
+        Returns:
+            bool: Whether sending was successful
+        """
+        topic_bytes = topic.encode('utf-8')
+        if isinstance(content, (bytes, bytearray)):
+            content_bytes = bytes(content)
+        else:
+            content_bytes = content.encode('utf-8') if content else b''
+        
+        # Small header, content sent straight from its own buffer
+        header = b''.join((
+            _PREFIX_AND_TLEN.pack(self.CTP_PREFIX, len(topic_bytes)),  # "CTP:" + topic length (6 bytes)
+            topic_bytes,                                               # topic content
+            _HDR_I.pack(len(content_bytes))                            # content length (4 bytes, little endian)
+        ))
+        return self._send_frame(header, content_bytes)
+    
+    def _send_frame(self, *parts):
+        """
+        Send one complete CTP frame
+        
+        Args:
+            parts: Consecutive pieces of the frame, gather-written where supported
             
         Returns:
             bool: Whether sending was successful
         """
         if not self.sock:
-            print("Not connected to device")
+            log.warning("Not connected to device")
             return False
         
         try:
-            # Construct CTP message
-            topic_bytes = topic.encode('utf-8')
-            content_bytes = content.encode('utf-8') if content else b''
+            if len(parts) == 1:
+                self.sock.sendall(parts[0])
+            elif _HAS_SENDMSG:
+                self._sendmsg_all(parts)
+            else:
+                self.sock.sendall(b''.join(parts))
             
-            # Calculate length (little endian)
-            topic_len = len(topic_bytes)
-            content_len = len(content_bytes)
-            
-            # Construct complete CTP message packet
-            message = (
-                self.CTP_PREFIX +                                    # "CTP:" (4 bytes)
-                struct.pack('<H', topic_len) +                      # topic length (2 bytes, little endian)
-                topic_bytes +                                        # topic content
-                struct.pack('<I', content_len) +                    # content length (4 bytes, little endian)
-                content_bytes                                        # content data
-            )
-            
-            # Send message
-            self.sock.sendall(message)
-            print(f"CTP message sent:")
-            print(f"  Topic: {topic}")
-            print(f"  Content: {content}")
-            print(f"  Message length: {len(message)} bytes")
+            log.debug("CTP frame sent: %r", parts)
             
             return True
             
         except Exception as e:
-            print(f"Failed to send message: {e}")
+            log.error("Failed to send message: %s", e)
             return False
     
-    def send_sta_ssid_info(self, ssid, password):
+    def _sendmsg_all(self, buffers):
+        """
+        Gather-write all buffers, resuming after partial sends
+        
+        Args:
+            buffers: List of bytes-like objects to send in order
+        """
+        views = [memoryview(b) for b in buffers if len(b)]
+        while views:
+            sent = self.sock.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
+    
+    def send_sta_ssid_info(self, ssid, password, status="0", mqtt_server=None, mqtt_port=None):
         """
         Send STA_SSID_INFO command
         
         Args:
             ssid: WiFi name
             password: WiFi password
+            status: Value of the "status" field
+            mqtt_server: MQTT server address or domain, omitted from the payload if None
+            mqtt_port: MQTT server port number
             
         Returns:
             bool: Whether sending was successful
         """
-        # Construct JSON content
-        content = {
-            "op": "PUT",
-            "param": {
-                "ssid": JioFiber-EASO,
-                "pwd": 7285045500,
-                "status": "0"
-            }
-        }
+        return self._send_frame(build_sta_ssid_frame(ssid, password, status, mqtt_server, mqtt_port))
+    
+    def _fill(self, n):
+        """
+        Make sure at least n bytes are buffered in _rxbuf[:_rxlen]
         
-        # Convert to JSON string
-        content_str = json.dumps(content, separators=(',', ':'))
+        Reads straight into the free space of _rxbuf, so a small frame
+        arrives in one syscall. The buffer keeps its capacity between
+        responses and only grows for a frame larger than any seen before.
+        Whatever was read stays buffered if a later read fails, so the
+        stream is never cut mid-frame.
         
-        # Send CTP message
-        return self.send_ctp_message("STA_SSID_INFO", content_str)
+        Args:
+            n: Number of bytes needed
+        """
+        if self._rxlen >= n:
+            return
+        
+        rxbuf = self._rxbuf
+        if n > len(rxbuf):
+            rxbuf.extend(bytes(n - len(rxbuf)))
+        with memoryview(rxbuf) as view:
+            while self._rxlen < n:
+                got = self.sock.recv_into(view[self._rxlen:])
+                if got == 0:
+                    raise ConnectionError(f"Connection closed after {self._rxlen} of {n} bytes")
+                self._rxlen += got
     
     def receive_response(self, timeout=5):
         """
@@ -129,60 +322,64 @@ class CTPClient:
             timeout: Timeout in seconds
             
         Returns:
-            str: Response content, returns None if timeout
+            bytes: Raw UTF-8 response content, returns None if timeout
+        
+        If the device closes or resets the connection before any of the
+        response has arrived, the client is disconnected.
         """
         if not self.sock:
             return None
         
         try:
-            self.sock.settimeout(timeout)
+            # settimeout costs a syscall; skip it when nothing changes
+            if timeout != self._timeout:
+                self.sock.settimeout(timeout)
+                self._timeout = timeout
             
-            # Receive CTP prefix
-            prefix = self.sock.recv(self.CTP_PREFIX_LEN)
-            if len(prefix) != self.CTP_PREFIX_LEN:
-                print("Failed to receive CTP prefix")
-                return None
-            
-            if prefix != self.CTP_PREFIX:
-                print(f"Invalid CTP prefix: {prefix}")
-                return None
+            # The frame is only consumed from _rxbuf once it is complete; bytes
+            # beyond it stay buffered for the next response
+            rxbuf = self._rxbuf
             
-            # Receive topic length
-            topic_len_data = self.sock.recv(self.CTP_TOPIC_LEN)
-            if len(topic_len_data) != self.CTP_TOPIC_LEN:
-                print("Failed to receive topic length")
+            # Receive CTP prefix and topic length
+            self._fill(CTP_HEADER_LEN)
+            try:
+                topic_len = unpack_topic_len(rxbuf)
+            except ValueError as e:
+                log.warning("%s", e)
+                self._rxlen = 0
                 return None
             
-            topic_len = struct.unpack('<H', topic_len_data)[0]
-            
-            # Receive topic content
-            topic = self.sock.recv(topic_len).decode('utf-8')
+            # Receive topic content and content length
+            content_off = CTP_HEADER_LEN + topic_len + CTP_TOPIC_CONTENT_LEN
+            self._fill(content_off)
+            content_len = unpack_content_len(rxbuf, content_off - CTP_TOPIC_CONTENT_LEN)
             
-            # Receive content length
-            content_len_data = self.sock.recv(self.CTP_TOPIC_CONTENT_LEN)
-            if len(content_len_data) != self.CTP_TOPIC_CONTENT_LEN:
-                print("Failed to receive content length")
-                return None
-            
-            content_len = struct.unpack('<I', content_len_data)[0]
+            # Receive content data, kept as bytes for the JSON parser
+            frame_len = content_off + content_len
+            self._fill(frame_len)
+            topic = rxbuf[CTP_HEADER_LEN:CTP_HEADER_LEN + topic_len].decode('utf-8', 'replace')
+            with memoryview(rxbuf) as view:
+                content = bytes(view[content_off:frame_len])
             
-            # Receive content data
-            if content_len > 0:
-                content = self.sock.recv(content_len).decode('utf-8')
-            else:
-                content = ""
+            rest = self._rxlen - frame_len
+            if rest:
+                rxbuf[:rest] = rxbuf[frame_len:self._rxlen]
+            self._rxlen = rest
             
-            print(f"Response received:")
-            print(f"  Topic: {topic}")
-            print(f"  Content: {content}")
+            log.debug("Response received: topic=%s content=%r", topic, content)
             
             return content
             
         except socket.timeout:
-            print("Response timeout")
+            log.warning("Response timeout")
+            return None
+        except ConnectionError as e:
+            log.info("Connection lost while waiting for response: %s", e)
+            if not self._rxlen:
+                self.disconnect()
             return None
         except Exception as e:
-            print(f"Failed to receive response: {e}")
+            log.error("Failed to receive response: %s", e)
             return None
 
 def main():
@@ -211,7 +408,7 @@ def main():
             if response:
                 try:
                     # Parse JSON response
-                    response_json = json.loads(response)
+                    response_json = json_loads(response)
                     print(f"\nDevice response parsed:")
                     print(json.dumps(response_json, indent=2, ensure_ascii=False))
                     
@@ -221,8 +418,8 @@ def main():
                     else:
                         print(f"\n❌ WiFi configuration failed: {response_json.get('param', {}).get('error', 'Unknown error')}")
                         
-                except json.JSONDecodeError:
-                    print(f"\n⚠️ Response format error: {response}")
+                except ValueError:  # JSONDecodeError, or UnicodeDecodeError from stdlib json
+                    print(f"\n⚠️ Response format error: {response!r}")
             else:
                 print("\n⚠️ No device response received")
         else:
@@ -237,6 +434,7 @@ def main():
         client.disconnect()
 
 if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s: %(message)s")
     print("CTP Protocol Client - WiFi Configuration Tool")
     print("=" * 50)
     
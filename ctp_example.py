@@ -5,11 +5,106 @@ CTP Protocol Client Usage Example
 Quick sending of STA_SSID_INFO commands
 """
 
-import socket
-import struct
-import json
+import asyncio
+import atexit
+import logging
 
-def send_sta_ssid_info(host, port, ssid, password, mqtt_server="95.216.222.194", mqtt_port=1883):
+from ctp_client import (CTP_HEADER_LEN, CTP_TOPIC_CONTENT_LEN, CTPClient, build_sta_ssid_frame,
+                        json_loads, unpack_content_len, unpack_topic_len)
+
+log = logging.getLogger(__name__)
+
+# Connected clients keyed by (host, port), reused across calls
+_POOL = {}
+
+
+def get_client(host, port):
+    """
+    Get a connected CTPClient for host:port, reusing a pooled connection
+    
+    Args:
+        host: Device IP address
+        port: Device port number
+        
+    Returns:
+        CTPClient: Connected client, returns None if connection failed
+    """
+    key = (host, port)
+    client = _POOL.pop(key, None)
+    if client is not None:
+        # Devices close the connection after applying a config or rebooting
+        if client.is_alive():
+            _POOL[key] = client
+            return client
+        client.disconnect()
+    
+    client = CTPClient(host=host, port=port)
+    if not client.connect():
+        return None
+    _POOL[key] = client
+    return client
+
+
+def close_pool():
+    """Disconnect all pooled clients"""
+    while _POOL:
+        _, client = _POOL.popitem()
+        client.disconnect()
+
+
+atexit.register(close_pool)
+
+
+def _check_response(response_content):
+    """
+    Check the device's STA_SSID_INFO response
+    
+    Args:
+        response_content: Raw response content
+        
+    Returns:
+        bool: Whether the device accepted the configuration
+    """
+    if not response_content:
+        log.warning("Received empty response")
+        return False
+    
+    # Content: {"op":"NOTIFY","param":{"ssid":"TJxu","pwd":"Xu***888","status":"1","mqtt_server":"broker.emqx.io","mqtt_port":"1883"}}
+    # Parse response
+    try:
+        response_json = json_loads(response_content)
+    except ValueError:  # JSONDecodeError, or UnicodeDecodeError from stdlib json
+        log.warning("Response format error: %r", response_content)
+        return False
+    
+    if response_json.get('op') == 'NOTIFY':
+        param = response_json.get('param', {})
+        log.debug("WiFi and MQTT configuration successful: mqtt=%s:%s",
+                  param.get('mqtt_server'), param.get('mqtt_port'))
+        return True
+    log.warning("WiFi configuration failed: %s",
+                response_json.get('param', {}).get('error', 'Unknown error'))
+    return False
+
+
+def _exchange(client, ssid, password, mqtt_server, mqtt_port):
+    """
+    Send STA_SSID_INFO on client and receive the response
+    
+    Returns:
+        tuple: (response content or None, whether the connection failed
+                before any of the response arrived)
+    """
+    if not client.send_sta_ssid_info(ssid, password, status="1",
+                                     mqtt_server=mqtt_server, mqtt_port=mqtt_port):
+        return None, True
+    log.debug("STA_SSID_INFO command sent: ssid=%s mqtt=%s:%s", ssid, mqtt_server, mqtt_port)
+    
+    response_content = client.receive_response(timeout=5)
+    return response_content, response_content is None and client.sock is None
+
+
+def send_sta_ssid_info(host, port, ssid, password, mqtt_server="95.216.222.194", mqtt_port=1883, client=None):
     """
     Send STA_SSID_INFO command
     
@@ -20,109 +115,137 @@ def send_sta_ssid_info(host, port, ssid, password, mqtt_server="95.216.222.194",
         password: WiFi password
         mqtt_server: MQTT server address or domain
         mqtt_port: MQTT server port number
+        client: Connected CTPClient to use, defaults to the pooled one for host:port
     """
+    pooled = client is None
+    reused = False
+    if pooled:
+        previous = _POOL.get((host, port))
+        client = get_client(host, port)
+        if client is None:
+            log.error("Connection failed, please check device IP and port: %s:%s", host, port)
+            return False
+        reused = client is previous
+    
+    healthy = False
     try:
-        # Create socket connection
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(10)
-        sock.connect((host, port))
-        print(f"✅ Connected to {host}:{port}")
-        
-        # Construct JSON content
-        content = {
-            "op": "PUT",
-            "param": {
-                "ssid": ssid,
-                "pwd": password,
-                "status": "1",
-                "mqtt_server": mqtt_server,
-                "mqtt_port": str(mqtt_port)
-            }
-        }
-        content_str = json.dumps(content, separators=(',', ':'))
-        
-        # Construct CTP message packet
-        topic = "STA_SSID_INFO"
-        topic_bytes = topic.encode('utf-8')
-        content_bytes = content_str.encode('utf-8')
-        
-        # Little endian length
-        topic_len = len(topic_bytes)
-        content_len = len(content_bytes)
+        response_content, lost = _exchange(client, ssid, password, mqtt_server, mqtt_port)
         
-        message = (
-            b"CTP:" +                                    # CTP prefix
-            struct.pack('<H', topic_len) +              # topic length (little endian)
-            topic_bytes +                                # topic content
-            struct.pack('<I', content_len) +            # content length (little endian)
-            content_bytes                                # content data
-        )
-        
-        # Send message
-        sock.sendall(message)
-        print(f"📤 STA_SSID_INFO command sent")
-        print(f"   SSID: {ssid}")
-        print(f"   Password: {password}")
-        print(f"   MQTT Server: {mqtt_server}")
-        print(f"   MQTT Port: {mqtt_port}")
-        print(f"   Message length: {len(message)} bytes")
-        
-        # Receive response
-        print("⏳ Waiting for device response...")
-        sock.settimeout(5)
+        if response_content is None and lost and reused:
+            # The device may close a pooled connection just after its last
+            # reply, before is_alive() can see it. STA_SSID_INFO is an
+            # idempotent PUT, so retry once on a fresh connection.
+            log.debug("Pooled connection to %s:%s went stale, reconnecting", host, port)
+            _POOL.pop((host, port), None)
+            client.disconnect()
+            client = get_client(host, port)
+            if client is None:
+                log.error("Connection failed, please check device IP and port: %s:%s", host, port)
+                return False
+            response_content, _ = _exchange(client, ssid, password, mqtt_server, mqtt_port)
         
-        # Receive CTP prefix
-        prefix = sock.recv(4)
-        if prefix != b"CTP:":
-            print("❌ Invalid CTP prefix")
+        if response_content is None:
+            log.warning("No valid response received")
             return False
+        healthy = True
         
-        # Receive topic length and content
-        topic_len_data = sock.recv(2)
-        topic_len = struct.unpack('<H', topic_len_data)[0]
-        topic = sock.recv(topic_len).decode('utf-8')
-        
-        # Receive content length and data
-        content_len_data = sock.recv(4)
-        content_len = struct.unpack('<I', content_len_data)[0]
-        
-        if content_len > 0:
-            response_content = sock.recv(content_len).decode('utf-8')
-            print(f"📥 Response received:")
-            print(f"   Topic: {topic}")
-            print(f"   Content: {response_content}")
-            # Content: {"op":"NOTIFY","param":{"ssid":"TJxu","pwd":"Xu***888","status":"1","mqtt_server":"broker.emqx.io","mqtt_port":"1883"}}
-            # Parse response
-            try:
-                response_json = json.loads(response_content)
-                if response_json.get('op') == 'NOTIFY':
-                    print("✅ WiFi and MQTT configuration successful!")
-                    param = response_json.get('param', {})
-                    if 'mqtt_server' in param and 'mqtt_port' in param:
-                        print(f"   MQTT Server: {param['mqtt_server']}")
-                        print(f"   MQTT Port: {param['mqtt_port']}")
-                    return True
-                else:
-                    print(f"❌ WiFi configuration failed: {response_json.get('param', {}).get('error', 'Unknown error')}")
-                    return False
-            except json.JSONDecodeError:
-                print(f"⚠️ Response format error: {response_content}")
-                return False
-        else:
-            print("⚠️ Received empty response")
-            return False
+        return _check_response(response_content)
             
-    except socket.timeout:
-        print("❌ Response timeout")
+    except Exception as e:
+        log.error("Send failed: %s", e)
         return False
-    except ConnectionRefusedError:
-        print(f"❌ Connection refused, please check device IP and port: {host}:{port}")
+    finally:
+        # A connection in an unknown state must not be handed out again
+        if pooled and not healthy and client is not None:
+            _POOL.pop((host, port), None)
+            client.disconnect()
+
+
+async def _read_response_async(reader):
+    """Read one CTP frame from reader and return its raw content"""
+    header = await reader.readexactly(CTP_HEADER_LEN)
+    topic_len = unpack_topic_len(header)
+    
+    topic_data = await reader.readexactly(topic_len + CTP_TOPIC_CONTENT_LEN)
+    content_len = unpack_content_len(topic_data, topic_len)
+    return await reader.readexactly(content_len)
+
+
+async def send_sta_ssid_info_async(host, port, ssid, password, mqtt_server="95.216.222.194", mqtt_port=1883):
+    """
+    Send STA_SSID_INFO command without blocking the event loop
+    
+    Args:
+        host: Device IP address
+        port: Device port number
+        ssid: WiFi name
+        password: WiFi password
+        mqtt_server: MQTT server address or domain
+        mqtt_port: MQTT server port number
+        
+    Returns:
+        bool: Whether the device accepted the configuration
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=10)
+    except (OSError, asyncio.TimeoutError) as e:
+        log.error("Connection failed, please check device IP and port: %s:%s (%s)", host, port, e)
+        return False
+    
+    try:
+        writer.write(build_sta_ssid_frame(ssid, password, "1", mqtt_server, mqtt_port))
+        await writer.drain()
+        log.debug("STA_SSID_INFO command sent to %s:%s: ssid=%s", host, port, ssid)
+        
+        response_content = await asyncio.wait_for(_read_response_async(reader), timeout=5)
+        return _check_response(response_content)
+        
+    except asyncio.TimeoutError:
+        log.warning("Response timeout from %s:%s", host, port)
         return False
     except Exception as e:
-        print(f"❌ Send failed: {e}")
+        log.error("Send to %s:%s failed: %s", host, port, e)
         return False
     finally:
-        sock.close()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def provision_many_async(devices):
+    """Send STA_SSID_INFO to all devices concurrently, see provision_many"""
+    return await asyncio.gather(*(send_sta_ssid_info_async(**device) for device in devices))
+
+
+def provision_many(devices):
+    """
+    Send STA_SSID_INFO to several devices
+    
+    Every device gets its own connection, closed once its command is done;
+    the connection pool is not used. A single device is handled without
+    starting an event loop, with the same behaviour.
+    
+    Args:
+        devices: List of dicts of send_sta_ssid_info_async keyword arguments
+                 (host, port, ssid, password, optionally mqtt_server, mqtt_port)
+        
+    Returns:
+        list: Success flag per device, in the same order
+    """
+    if len(devices) == 1:
+        device = devices[0]
+        client = CTPClient(host=device['host'], port=device['port'])
+        if not client.connect():
+            log.error("Connection failed, please check device IP and port: %s:%s",
+                      device['host'], device['port'])
+            return [False]
+        try:
+            return [send_sta_ssid_info(client=client, **device)]
+        finally:
+            client.disconnect()
+    return asyncio.run(provision_many_async(devices))
 
 if __name__ == "__main__":
     # Configuration parameters
@@ -134,6 +257,7 @@ if __name__ == "__main__":
     # MQTT_SERVER = "172.20.10.3"  # MQTT server address
     MQTT_PORT = 1883               # MQTT server port
     
+    logging.basicConfig(format="%(levelname)s: %(message)s")
     print("CTP Protocol Client - Quick WiFi Configuration")
     print("=" * 40)
     print(f"Device address: {DEVICE_IP}:{DEVICE_PORT}")
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for CTP framing over local sockets
+Run with: python -m unittest
+"""
+
+import os
+import socket
+import struct
+import threading
+import time
+import unittest
+
+import ctp_client
+from ctp_client import CTPClient
+
+
+def frame(topic, content):
+    """Build a CTP frame independently of ctp_client"""
+    return (b"CTP:" + struct.pack('<H', len(topic)) + topic +
+            struct.pack('<I', len(content)) + content)
+
+
+def recv_frame(sock):
+    """Read one CTP frame from sock and return (topic, content)"""
+    def recv_exact(n):
+        data = b''
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+    topic_len = struct.unpack('<H', recv_exact(6)[4:])[0]
+    topic = recv_exact(topic_len)
+    content_len = struct.unpack('<I', recv_exact(4))[0]
+    return topic, recv_exact(content_len)
+
+
+class PartialSendSocket:
+    """Socket stand-in whose sendmsg writes at most 3 bytes per call"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        chunk = b''.join(bytes(b) for b in buffers)[:3]
+        self.data += chunk
+        return len(chunk)
+
+
+class ReceiveResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device, sock = socket.socketpair()
+        self.client = CTPClient()
+        self.client.sock = sock
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.device.close()
+
+    def test_fragmented_response(self):
+        data = frame(b"STA_SSID_INFO", b'{"op":"NOTIFY"}')
+
+        def feed():
+            for i in range(len(data)):
+                self.device.sendall(data[i:i + 1])
+                time.sleep(0.001)
+        feeder = threading.Thread(target=feed)
+        feeder.start()
+        self.assertEqual(self.client.receive_response(), b'{"op":"NOTIFY"}')
+        feeder.join()
+
+    def test_large_response(self):
+        content = b"x" * 100000
+        feeder = threading.Thread(target=self.device.sendall, args=(frame(b"T", content),))
+        feeder.start()
+        self.assertEqual(self.client.receive_response(), content)
+        feeder.join()
+
+    def test_two_frames_in_one_read(self):
+        self.device.sendall(frame(b"A", b"1") + frame(b"B", b"22"))
+        self.assertEqual(self.client.receive_response(), b"1")
+        self.assertEqual(self.client.receive_response(), b"22")
+        self.assertEqual(self.client._rxlen, 0)
+
+    def test_receive_buffer_is_reused(self):
+        rxbuf = self.client._rxbuf
+        capacity = len(rxbuf)
+        for _ in range(3):
+            self.device.sendall(frame(b"A", b'{"op":"NOTIFY"}'))
+            self.assertEqual(self.client.receive_response(), b'{"op":"NOTIFY"}')
+        self.assertIs(self.client._rxbuf, rxbuf)
+        self.assertEqual(len(rxbuf), capacity)
+
+    def test_timeout_mid_frame_resumes(self):
+        data = frame(b"STA_SSID_INFO", b'{"op":"NOTIFY"}')
+        self.device.sendall(data[:15])
+        self.assertIsNone(self.client.receive_response(timeout=0.1))
+        self.device.sendall(data[15:])
+        self.assertEqual(self.client.receive_response(timeout=0.1), b'{"op":"NOTIFY"}')
+
+    def test_closed_before_response_disconnects(self):
+        self.device.close()
+        self.assertIsNone(self.client.receive_response())
+        self.assertIsNone(self.client.sock)
+
+
+class IsAliveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device, sock = socket.socketpair()
+        self.client = CTPClient()
+        self.client.sock = sock
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.device.close()
+
+    def test_open_connection(self):
+        self.assertTrue(self.client.is_alive())
+
+    def test_closed_by_device(self):
+        self.device.close()
+        self.assertFalse(self.client.is_alive())
+
+    def test_descriptor_above_fd_setsize(self):
+        try:
+            high_fd = os.dup2(self.client.sock.fileno(), 2000)
+        except OSError:
+            self.skipTest("cannot open descriptor 2000")
+        self.client.sock.close()
+        self.client.sock = socket.socket(fileno=high_fd)
+        self.assertTrue(self.client.is_alive())
+        self.device.close()
+        self.assertFalse(self.client.is_alive())
+
+
+class SendTest(unittest.TestCase):
+
+    def test_partial_sendmsg_resumes(self):
+        client = CTPClient()
+        client.sock = PartialSendSocket()
+        client._sendmsg_all([b"CTP:\x01\x00T\x02\x00\x00\x00", b"", b"ok"])
+        self.assertEqual(client.sock.data, b"CTP:\x01\x00T\x02\x00\x00\x00ok")
+        self.assertEqual(client.sock.calls, 5)
+
+    def test_send_ctp_message_frame(self):
+        device, sock = socket.socketpair()
+        client = CTPClient()
+        client.sock = sock
+        try:
+            self.assertTrue(client.send_ctp_message("TOPIC", '{"a":1}'))
+            self.assertEqual(recv_frame(device), (b"TOPIC", b'{"a":1}'))
+        finally:
+            client.disconnect()
+            device.close()
+
+    def test_sta_ssid_info_escapes_values(self):
+        data = ctp_client.build_sta_ssid_frame('a"b\\c', 'pw', "1", "host", 1883)
+        self.assertEqual(data[:4], b"CTP:")
+        topic_len = ctp_client.unpack_topic_len(data)
+        content = data[ctp_client.CTP_HEADER_LEN + topic_len + ctp_client.CTP_TOPIC_CONTENT_LEN:]
+        self.assertEqual(ctp_client.json_loads(content)["param"],
+                         {"ssid": 'a"b\\c', "pwd": "pw", "status": "1",
+                          "mqtt_server": "host", "mqtt_port": "1883"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the CTP usage example
+Run with: python -m unittest
+"""
+
+import socket
+import threading
+import unittest
+
+import ctp_client
+import ctp_example
+from test_ctp_client import frame, recv_frame
+
+
+class FakeDevice:
+    """Loopback device answering each STA_SSID_INFO with NOTIFY"""
+
+    def __init__(self, close_after_reply=False):
+        self.close_after_reply = close_after_reply
+        self.connections = 0
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                while True:
+                    topic, _ = recv_frame(conn)
+                    conn.sendall(frame(topic, b'{"op":"NOTIFY","param":{}}'))
+                    if self.close_after_reply:
+                        return
+            except (EOFError, OSError):
+                return
+
+    def close(self):
+        self.server.close()
+
+
+class ExampleTest(unittest.TestCase):
+
+    def tearDown(self):
+        ctp_example.close_pool()
+
+    def test_pool_reuses_connection(self):
+        device = FakeDevice()
+        try:
+            for _ in range(3):
+                self.assertTrue(ctp_example.send_sta_ssid_info('127.0.0.1', device.port, "s", "p"))
+            self.assertEqual(device.connections, 1)
+        finally:
+            device.close()
+
+    def test_pool_reconnects_after_device_closes(self):
+        # Back-to-back calls race the device's FIN; the retry must cover it
+        for _ in range(20):
+            device = FakeDevice(close_after_reply=True)
+            try:
+                for _ in range(3):
+                    self.assertTrue(ctp_example.send_sta_ssid_info('127.0.0.1', device.port, "s", "p"))
+            finally:
+                ctp_example.close_pool()
+                device.close()
+
+    def test_provision_many(self):
+        devices = [FakeDevice(), FakeDevice()]
+        try:
+            results = ctp_example.provision_many(
+                [dict(host='127.0.0.1', port=d.port, ssid="s", password="p") for d in devices])
+            self.assertEqual(results, [True, True])
+        finally:
+            for device in devices:
+                device.close()
+
+    def test_provision_one_closes_connection(self):
+        device = FakeDevice()
+        try:
+            results = ctp_example.provision_many(
+                [dict(host='127.0.0.1', port=device.port, ssid="s", password="p")])
+            self.assertEqual(results, [True])
+            self.assertEqual(ctp_example._POOL, {})
+        finally:
+            device.close()
+
+    def test_provision_many_rejects_client_key(self):
+        device = FakeDevice()
+        try:
+            for count in (1, 2):
+                devices = [dict(host='127.0.0.1', port=device.port, ssid="s", password="p",
+                                client=None)] * count
+                with self.assertRaises(TypeError):
+                    ctp_example.provision_many(devices)
+        finally:
+            device.close()
+
+    def test_invalid_utf8_response_without_orjson(self):
+        orjson = ctp_client.orjson
+        ctp_client.orjson = None
+        try:
+            self.assertFalse(ctp_example._check_response(b'{"op":"\xff"}'))
+        finally:
+            ctp_client.orjson = orjson
+
+
+if __name__ == "__main__":
+    unittest.main()